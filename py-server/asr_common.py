@@ -0,0 +1,38 @@
+import numpy as np
+
+# Shared by main.py (jif), transcribe.py (youtube-transcriber) and asr_service.py (korai-asr).
+# Each app's image ships this file with .add_local_python_source("asr_common").
+
+# Modal app name of the shared ASR service in asr_service.py
+ASR_APP_NAME = "korai-asr"
+SAMPLE_RATE = 16000
+
+
+def to_pcm16(audio: np.ndarray) -> np.ndarray:
+    """int16 PCM halves the payload when audio is passed to another container."""
+    return np.clip(np.asarray(audio) * 32768.0, -32768, 32767).astype(np.int16)
+
+
+def pcm16_to_float32(pcm16: np.ndarray) -> np.ndarray:
+    """WhisperX expects float32 in [-1, 1]."""
+    return pcm16.astype(np.float32) / 32768.0
+
+
+def speech_chunks(pipeline, audio: np.ndarray, chunk_size: int = 30) -> list:
+    """VAD-merged speech chunks of at most `chunk_size` seconds, as in FasterWhisperPipeline.transcribe."""
+    # Imported here so main.py can use the PCM helpers without loading WhisperX
+    from whisperx.vads import Pyannote, Vad
+
+    if isinstance(pipeline.vad_model, Vad):
+        waveform = pipeline.vad_model.preprocess_audio(audio)
+        merge_chunks = pipeline.vad_model.merge_chunks
+    else:
+        waveform = Pyannote.preprocess_audio(audio)
+        merge_chunks = Pyannote.merge_chunks
+    vad_segments = pipeline.vad_model({"waveform": waveform, "sample_rate": SAMPLE_RATE})
+    return merge_chunks(
+        vad_segments,
+        chunk_size,
+        onset=pipeline._vad_params["vad_onset"],
+        offset=pipeline._vad_params["vad_offset"],
+    )
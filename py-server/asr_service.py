@@ -0,0 +1,115 @@
+import time
+
+import modal
+import numpy as np
+import torch
+import whisperx
+from faster_whisper.tokenizer import Tokenizer
+
+from asr_common import ASR_APP_NAME, SAMPLE_RATE, pcm16_to_float32, speech_chunks
+
+# Shared WhisperX ASR for main.py (jif) and transcribe.py (youtube-transcriber).
+# Deploy with `modal deploy asr_service.py`. The apps call it through
+# modal.Cls.from_name(ASR_APP_NAME, "AsrService") when KORAI_SHARED_ASR=1 is set in their secrets.
+image = (modal.Image.from_registry(
+    "nvidia/cuda:12.4.0-devel-ubuntu22.04", add_python="3.10")
+    .apt_install(["ffmpeg", "git", "libcudnn8"])
+    .pip_install(
+        [
+            "numpy==2.0.2",
+            "pyannote.audio==3.4.0",
+            "torch",
+            "torchaudio",
+            "whisperx @ git+https://github.com/m-bain/whisperx.git",
+        ],
+    )
+    .add_local_python_source("asr_common")
+)
+
+app = modal.App(ASR_APP_NAME, image=image)
+
+CHUNK_SECONDS = 30
+
+# Requests that arrive within BATCH_WAIT_MS of each other are coalesced into one call
+MAX_REQUESTS_PER_BATCH = 16
+BATCH_WAIT_MS = 500
+
+# Decoder batches are sized from free GPU memory after the model is resident.
+# CHUNK_MEMORY_MB is the peak working set of one 30s chunk for large-v2 in float16.
+CHUNK_MEMORY_MB = 300
+GPU_MEMORY_FRACTION = 0.8
+MAX_CHUNKS_PER_BATCH = 64
+
+
+@app.cls(gpu="A10G", timeout=900, scaledown_window=300, secrets=[modal.Secret.from_name("huggingface")],
+         enable_memory_snapshot=True, experimental_options={"enable_gpu_snapshot": True})
+class AsrService:
+    @modal.enter(snap=True)
+    def load_model(self):
+        print("Loading WhisperX model...")
+        start_time = time.time()
+        self.pipeline = whisperx.load_model("large-v2", device="cuda", compute_type="float16")
+        self.tokenizers = {}
+        print(f"WhisperX model loaded in {time.time() - start_time:.2f} seconds")
+
+    @modal.enter(snap=False)
+    def size_batches(self):
+        free_bytes, _ = torch.cuda.mem_get_info()
+        budget = int(free_bytes * GPU_MEMORY_FRACTION / (CHUNK_MEMORY_MB * 1024 ** 2))
+        self.chunks_per_batch = max(1, min(MAX_CHUNKS_PER_BATCH, budget))
+        print(f"{free_bytes / 1024 ** 3:.1f} GiB free, decoding up to {self.chunks_per_batch} chunks per batch")
+
+    def get_tokenizer(self, language: str) -> Tokenizer:
+        if language not in self.tokenizers:
+            self.tokenizers[language] = Tokenizer(
+                self.pipeline.model.hf_tokenizer,
+                self.pipeline.model.model.is_multilingual,
+                task="transcribe",
+                language=language,
+            )
+        return self.tokenizers[language]
+
+    @modal.batched(max_batch_size=MAX_REQUESTS_PER_BATCH, wait_ms=BATCH_WAIT_MS)
+    def transcribe(self, audios: list, languages: list) -> list:
+        """
+        Transcribe a batch of concurrent requests.
+        Each request is VAD-chunked on its own, then chunks from every request with the same
+        language are decoded together in GPU batches of up to `chunks_per_batch`.
+        Returns one {"segments", "language"} dict per request, like FasterWhisperPipeline.transcribe.
+        """
+        start_time = time.time()
+        results = []
+        pending = {}  # language -> [(request index, chunk, chunk samples)]
+        for request_index, (pcm16, language) in enumerate(zip(audios, languages)):
+            audio = pcm16_to_float32(pcm16)
+            if audio.size == 0:
+                results.append({"segments": [], "language": language or "en"})
+                continue
+            language = language or self.pipeline.detect_language(audio)
+            results.append({"segments": [], "language": language})
+            for chunk in speech_chunks(self.pipeline, audio, CHUNK_SECONDS):
+                chunk_audio = audio[int(chunk["start"] * SAMPLE_RATE):int(chunk["end"] * SAMPLE_RATE)]
+                pending.setdefault(language, []).append((request_index, chunk, chunk_audio))
+
+        num_chunks = sum(len(chunks) for chunks in pending.values())
+        num_batches = 0
+        for language, chunks in pending.items():
+            tokenizer = self.get_tokenizer(language)
+            for batch_start in range(0, len(chunks), self.chunks_per_batch):
+                batch = chunks[batch_start:batch_start + self.chunks_per_batch]
+                features = np.stack([
+                    self.pipeline.preprocess({"inputs": chunk_audio})["inputs"].numpy()
+                    for _, _, chunk_audio in batch
+                ])
+                texts = self.pipeline.model.generate_segment_batched(features, tokenizer, self.pipeline.options)
+                num_batches += 1
+                for (request_index, chunk, _), text in zip(batch, texts):
+                    results[request_index]["segments"].append({
+                        "text": text,
+                        "start": round(chunk["start"], 3),
+                        "end": round(chunk["end"], 3),
+                    })
+
+        print(f"Transcribed {len(audios)} request(s), {num_chunks} chunks in {num_batches} GPU batch(es) "
+              f"in {time.time() - start_time:.2f} seconds")
+        return results
@@ -0,0 +1,65 @@
+import glob
+import os
+import pathlib
+import pickle
+import shutil
+import sys
+
+import numpy as np
+
+from main import ASD_FPS, asd_frame_stride, build_crop_plan, interpolate_crop_path, load_scene_bounds, run_columbia
+
+# Accuracy vs. GPU time of each tracking_fps, measured on the path that ships.
+# Run it where Columbia is installed (/asd, with a GPU), e.g. inside the jif image:
+#
+#     python benchmark_tracking.py /path/to/clip.mp4 [work_dir]
+#
+# Columbia runs once at full rate and once per tracking_fps, each on its own copy of the clip,
+# and every reduced-rate crop path is compared with the full-rate one.
+
+RATES = (None, 12.5, 5, 2, 0)
+
+
+def crop_path_for_rate(work_dir: pathlib.Path, clip_path: str, tracking_fps) -> dict:
+    """Run speaker detection at `tracking_fps` and return its crop path and Columbia wall time."""
+    frame_stride = asd_frame_stride(tracking_fps)
+    rate_dir = work_dir / f"rate_{tracking_fps}"
+    rate_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copy(clip_path, rate_dir / "clip.mp4")
+    seconds = run_columbia(rate_dir, "clip", frame_stride)
+
+    clip_dir = rate_dir / "clip"
+    with open(clip_dir / "pywork" / "tracks.pckl", "rb") as f:
+        tracks = pickle.load(f)
+    with open(clip_dir / "pywork" / "scores.pckl", "rb") as f:
+        scores = pickle.load(f)
+    num_frames = len(glob.glob(os.path.join(clip_dir, "pyframes", "*.jpg")))
+    path_x, path_y, path_has_face = build_crop_plan(tracks, scores, num_frames)
+    if tracking_fps is not None:
+        path_x, path_y, path_has_face = interpolate_crop_path(
+            path_x, path_y, path_has_face, tracking_fps=tracking_fps,
+            scene_bounds=load_scene_bounds(clip_dir / "pywork", num_frames), frame_stride=frame_stride)
+    return {"x": path_x, "y": path_y, "has_face": path_has_face, "seconds": seconds, "tracks": len(tracks)}
+
+
+def main(clip_path: str, work_dir: str):
+    work_dir = pathlib.Path(work_dir)
+    results = {rate: crop_path_for_rate(work_dir, clip_path, rate) for rate in RATES}
+    full = results[None]
+
+    print(f"Speaker tracking benchmark (vs full-rate {ASD_FPS} fps detection, {len(full['x'])} frames):")
+    for rate, result in results.items():
+        frames = min(len(full["x"]), len(result["x"]))
+        both = full["has_face"][:frames] & result["has_face"][:frames]
+        error = np.hypot(result["x"][:frames][both] - full["x"][:frames][both],
+                         result["y"][:frames][both] - full["y"][:frames][both])
+        label = "full rate" if rate is None else f"{rate} fps" if rate > 0 else "shot changes"
+        print(f"  {label:>12}: Columbia {result['seconds']:6.1f}s ({full['seconds'] / result['seconds']:.1f}x faster), "
+              f"{result['tracks']} track(s), "
+              f"mode agreement {np.mean(full['has_face'][:frames] == result['has_face'][:frames]):.1%}, "
+              f"mean error {np.mean(error) if len(error) else 0.0:.1f}px, "
+              f"p95 error {np.percentile(error, 95) if len(error) else 0.0:.1f}px")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "/tmp/benchmark_tracking")
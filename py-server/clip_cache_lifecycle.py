@@ -0,0 +1,54 @@
+import argparse
+import json
+
+import boto3
+
+# One-off deploy step: expire /restyle_clips intermediates (clip_cache/ in main.py) after a TTL.
+# Run it by hand with credentials that may manage the bucket's lifecycle, not from the serving containers:
+#
+#     python clip_cache_lifecycle.py            # print the configuration that would be written
+#     python clip_cache_lifecycle.py --apply    # write it
+#
+# S3 only replaces a bucket's lifecycle configuration as a whole, so the existing rules are read, this one
+# rule (matched by ID) is added or updated, and every other rule is written back unchanged. Run it while
+# nobody else is editing the bucket's lifecycle rules.
+
+BUCKET = "jif-backend"
+CLIP_CACHE_PREFIX = "clip_cache"
+RULE_ID = "korai-clip-cache-expiry"
+
+
+def lifecycle_rules(s3_client) -> list:
+    try:
+        return s3_client.get_bucket_lifecycle_configuration(Bucket=BUCKET)["Rules"]
+    except s3_client.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchLifecycleConfiguration":
+            raise
+        return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Set the clip_cache/ expiry rule on the bucket")
+    parser.add_argument("--days", type=int, default=30, help="Days before cached clip intermediates expire")
+    parser.add_argument("--apply", action="store_true", help="Write the configuration instead of printing it")
+    args = parser.parse_args()
+
+    s3_client = boto3.client("s3")
+    rules = lifecycle_rules(s3_client)
+    rule = {"ID": RULE_ID, "Filter": {"Prefix": f"{CLIP_CACHE_PREFIX}/"},
+            "Status": "Enabled", "Expiration": {"Days": args.days}}
+    if rule in rules:
+        print(f"{RULE_ID} is already set to {args.days} days, nothing to do")
+        return
+    rules = [existing for existing in rules if existing.get("ID") != RULE_ID] + [rule]
+
+    print(json.dumps({"Rules": rules}, indent=2, default=str))
+    if not args.apply:
+        print("Dry run; pass --apply to write this configuration")
+        return
+    s3_client.put_bucket_lifecycle_configuration(Bucket=BUCKET, LifecycleConfiguration={"Rules": rules})
+    print(f"{CLIP_CACHE_PREFIX}/ objects in {BUCKET} now expire after {args.days} days")
+
+
+if __name__ == "__main__":
+    main()
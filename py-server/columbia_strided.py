@@ -0,0 +1,103 @@
+import argparse
+import glob
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import time
+
+import cv2
+
+# Columbia_test.py with face detection on every `--detectStride`-th frame only, for tracking_fps.
+# Shipped next to Columbia_test.py in /asd and run from there, with the same arguments plus --detectStride.
+#
+# Everything else runs exactly as in Columbia_test.py: frames, scene detection and the audio stay at
+# 25 fps and natural rate. Columbia's track_shot interpolates face boxes between the sampled detections,
+# so every track still covers every frame, and TalkNet scores each track against unaltered audio.
+# minTrack (counted in detections) and numFailedDet (a gap in frames) are scaled to the stride so
+# short shots keep their tracks. The annotated video_out.avi is not rendered; main.py never reads it.
+
+ASD_FPS = 25
+
+
+def parse_stride() -> int:
+    """Take --detectStride off argv; Columbia_test parses the rest when it is imported."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--detectStride", type=int, default=1)
+    known, rest = parser.parse_known_args()
+    sys.argv = [sys.argv[0]] + rest
+    return max(1, known.detectStride)
+
+
+def detect_faces(args, detector, stride: int) -> list:
+    """Columbia's inference_video, run on every stride-th frame. The other frames get no detections."""
+    frame_paths = sorted(glob.glob(os.path.join(args.pyframesPath, "*.jpg")))
+    dets = []
+    for index, frame_path in enumerate(frame_paths):
+        dets.append([])
+        if index % stride:
+            continue
+        image = cv2.cvtColor(cv2.imread(frame_path), cv2.COLOR_BGR2RGB)
+        bboxes = detector.detect_faces(image, conf_th=0.9, scales=[args.facedetScale])
+        for bbox in bboxes:
+            dets[-1].append({"frame": index, "bbox": (bbox[:-1]).tolist(), "conf": bbox[-1]})
+    with open(os.path.join(args.pyworkPath, "faces.pckl"), "wb") as f:
+        pickle.dump(dets, f)
+    return dets
+
+
+def main():
+    stride = parse_stride()
+    import Columbia_test as columbia
+    from model.faceDetector.s3fd import S3FD
+
+    args = columbia.args
+    args.pyaviPath = os.path.join(args.savePath, "pyavi")
+    args.pyframesPath = os.path.join(args.savePath, "pyframes")
+    args.pyworkPath = os.path.join(args.savePath, "pywork")
+    args.pycropPath = os.path.join(args.savePath, "pycrop")
+    if os.path.exists(args.savePath):
+        shutil.rmtree(args.savePath)
+    for path in (args.pyaviPath, args.pyframesPath, args.pyworkPath, args.pycropPath):
+        os.makedirs(path, exist_ok=True)
+
+    threads = str(args.nDataLoaderThread)
+    args.videoFilePath = os.path.join(args.pyaviPath, "video.avi")
+    args.audioFilePath = os.path.join(args.pyaviPath, "audio.wav")
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", args.videoPath, "-qscale:v", "2", "-threads", threads,
+                    "-async", "1", "-r", str(ASD_FPS), args.videoFilePath], check=True)
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", args.videoFilePath, "-qscale:a", "0", "-ac", "1",
+                    "-vn", "-threads", threads, "-ar", "16000", args.audioFilePath], check=True)
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", args.videoFilePath, "-qscale:v", "2",
+                    "-threads", threads, "-f", "image2", os.path.join(args.pyframesPath, "%06d.jpg")], check=True)
+
+    scenes = columbia.scene_detect(args)
+
+    start_time = time.time()
+    faces = detect_faces(args, S3FD(device="cuda"), stride)
+    print(f"Face detection on every {stride}th frame took {time.time() - start_time:.2f} seconds")
+
+    # Shots are still measured in frames; tracks are measured in detections, of which there are 1/stride as many
+    min_shot_frames = args.minTrack
+    args.minTrack = max(1, args.minTrack // stride)
+    # Allow one missed sample between detections, as a full-rate run allows numFailedDet missed frames
+    args.numFailedDet = max(args.numFailedDet, 2 * stride)
+    all_tracks = []
+    for shot in scenes:
+        if shot[1].frame_num - shot[0].frame_num >= min_shot_frames:
+            all_tracks.extend(columbia.track_shot(args, faces[shot[0].frame_num:shot[1].frame_num]))
+
+    vid_tracks = [columbia.crop_video(args, track, os.path.join(args.pycropPath, "%05d" % index))
+                  for index, track in enumerate(all_tracks)]
+    with open(os.path.join(args.pyworkPath, "tracks.pckl"), "wb") as f:
+        pickle.dump(vid_tracks, f)
+
+    files = sorted(glob.glob(f"{args.pycropPath}/*.avi"))
+    scores = columbia.evaluate_network(files, args)
+    with open(os.path.join(args.pyworkPath, "scores.pckl"), "wb") as f:
+        pickle.dump(scores, f)
+
+
+if __name__ == "__main__":
+    main()
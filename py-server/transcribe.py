@@ -1,21 +1,26 @@
 import modal
 import os
-import pathlib
-import shutil
 import subprocess
+import tempfile
 import time
-import uuid
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from faster_whisper.tokenizer import Tokenizer
 import whisperx
 from whisperx.diarize import DiarizationPipeline
 from pydantic import BaseModel
-import yt_dlp
 import json
+import numpy as np
+import pyarrow as pa
+from typing import Optional
+
+from asr_common import ASR_APP_NAME, SAMPLE_RATE, pcm16_to_float32, speech_chunks, to_pcm16
 
 # Define the request model
 class TranscriptionRequest(BaseModel):
     youtube_url: str
+    sharded: Optional[bool] = None  # Split long audio across containers (None = only above SHARDED_MIN_SECONDS)
 
 # Define the Modal image, reusing parts from app.py
 image = (modal.Image.from_registry(
@@ -33,22 +38,250 @@ image = (modal.Image.from_registry(
             "fastapi[standard]"
         ],
     )
-    .pip_install(["pydub", "librosa"])
     .add_local_file(local_path="cookies.txt", remote_path="/root/cookies.txt")
+    .add_local_python_source("asr_common")
 )
 
 app = modal.App("youtube-transcriber", image=image)
 
 auth_scheme = HTTPBearer()
 
+def read_stderr_tail(stderr_file, limit: int = 4000) -> str:
+    stderr_file.seek(0)
+    return stderr_file.read().decode(errors="replace").strip()[-limit:]
+
+def fetch_audio_pcm(youtube_url: str, cookies_path: str = "/root/cookies.txt") -> np.ndarray:
+    """
+    Stream the native audio track (opus/m4a) from yt-dlp straight into one ffmpeg decode to
+    16 kHz mono float32, held in memory. No intermediate file is written or re-read.
+    """
+    print(f"Streaming audio from {youtube_url}...")
+    start_time = time.time()
+    fetch_cmd = ["yt-dlp", "--quiet", "--no-warnings", "--no-progress", "--cookies", cookies_path,
+                 "-f", "bestaudio/best", "-o", "-", youtube_url]
+    decode_cmd = ["ffmpeg", "-v", "error", "-threads", "0", "-i", "pipe:0",
+                  "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "pipe:1"]
+    # stderr goes to temp files rather than pipes: nothing drains a pipe while stdout is being read,
+    # so a chatty yt-dlp or ffmpeg would fill its stderr buffer and stall the whole chain
+    with tempfile.TemporaryFile() as fetch_stderr, tempfile.TemporaryFile() as decode_stderr:
+        fetch = subprocess.Popen(fetch_cmd, stdout=subprocess.PIPE, stderr=fetch_stderr)
+        decode = subprocess.Popen(decode_cmd, stdin=fetch.stdout, stdout=subprocess.PIPE, stderr=decode_stderr)
+        # ffmpeg now holds the only read end, so yt-dlp gets SIGPIPE if ffmpeg exits early
+        fetch.stdout.close()
+
+        # Growing a bytearray keeps the final array writable for torch without an extra copy
+        pcm = bytearray()
+        while chunk := decode.stdout.read(1 << 20):
+            pcm += chunk
+        decode.wait()
+        fetch.wait()
+        # When ffmpeg dies first yt-dlp fails with a broken pipe, so ffmpeg is checked first and both are reported
+        if decode.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to decode the audio stream: {read_stderr_tail(decode_stderr)}"
+                               f" (yt-dlp exit {fetch.returncode}: {read_stderr_tail(fetch_stderr) or 'no output'})")
+        if fetch.returncode != 0:
+            raise RuntimeError(f"yt-dlp failed to fetch audio: {read_stderr_tail(fetch_stderr)}"
+                               f" (ffmpeg: {read_stderr_tail(decode_stderr) or 'no output'})")
+
+    audio = np.frombuffer(pcm, dtype=np.float32)
+    print(f"Fetched {len(audio) / SAMPLE_RATE:.1f}s of audio in {time.time() - start_time:.2f} seconds")
+    return audio
+
+# Set KORAI_SHARED_ASR=1 to send ASR to the batched service in asr_service.py instead of a per-container model
+SHARED_ASR_ENABLED = os.environ.get("KORAI_SHARED_ASR") == "1"
+
+# Audio at least this long is split at VAD silences into ~SHARD_TARGET_SECONDS shards transcribed in parallel
+SHARDED_MIN_SECONDS = 1800
+SHARD_TARGET_SECONDS = 600
+# Minimum cosine similarity for two shards' speakers to be treated as the same person
+SPEAKER_MATCH_THRESHOLD = 0.6
+
+def connect_shared_asr():
+    """The shared AsrService when enabled and deployed, otherwise None so the caller loads WhisperX itself."""
+    if not SHARED_ASR_ENABLED:
+        return None
+    try:
+        service_cls = modal.Cls.from_name(ASR_APP_NAME, "AsrService")
+        service_cls.hydrate()  # Raises modal.exception.NotFoundError if the app is not deployed
+    except modal.exception.NotFoundError as e:
+        print(f"Shared ASR service '{ASR_APP_NAME}' unavailable ({e}), loading WhisperX locally.")
+        return None
+    return service_cls()
+
+def transcribe_with_shared_asr(service, audio: np.ndarray, language: Optional[str] = None) -> dict:
+    """Transcribe through the shared AsrService."""
+    return service.transcribe.remote(to_pcm16(audio), language)
+
+def verify_token(token: HTTPAuthorizationCredentials):
+    if token.credentials != os.environ["AUTH_TOKEN"]:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+def stream_transcription(pipeline, audio: np.ndarray, batch_size: int = 16):
+    """
+    Yield (language, segment) as each VAD chunk is decoded, instead of
+    returning once the whole file is done like FasterWhisperPipeline.transcribe.
+    """
+    vad_segments = speech_chunks(pipeline, audio)
+    language = pipeline.preset_language or pipeline.detect_language(audio)
+    pipeline.tokenizer = Tokenizer(pipeline.model.hf_tokenizer, pipeline.model.model.is_multilingual,
+                                   task="transcribe", language=language)
+
+    def chunk_inputs():
+        for vad_segment in vad_segments:
+            yield {"inputs": audio[int(vad_segment["start"] * SAMPLE_RATE):int(vad_segment["end"] * SAMPLE_RATE)]}
+
+    try:
+        for vad_segment, out in zip(vad_segments, pipeline(chunk_inputs(), batch_size=batch_size, num_workers=0)):
+            yield language, {
+                "text": out["text"],
+                "start": round(vad_segment["start"], 3),
+                "end": round(vad_segment["end"], 3),
+            }
+    finally:
+        if pipeline.preset_language is None:
+            pipeline.tokenizer = None
+
+# Columnar transcript responses, chosen with `Accept: application/vnd.apache.arrow.stream`.
+# Add `;compression=zstd` (or lz4) to compress the buffers; arrow-js clients must leave it off.
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+ARROW_COMPRESSIONS = ("zstd", "lz4")
+
+JSON_MEDIA_TYPES = ("application/json", "application/*", "*/*")
+
+def parse_accept(accept: Optional[str]) -> list:
+    """
+    (media type, params) for each Accept entry, highest q-value first and in header order on ties.
+    Entries with q=0 (explicitly not acceptable) or an unparseable q are dropped.
+    """
+    entries = []
+    for index, entry in enumerate((accept or "").split(",")):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        if not media_type:
+            continue
+        options = {}
+        for param in params:
+            if "=" in param:
+                key, value = param.split("=", 1)
+                options[key.strip().lower()] = value.strip().strip('"')
+        try:
+            quality = float(options.pop("q", 1))
+        except ValueError:
+            continue
+        if quality <= 0:
+            continue
+        entries.append((-quality, index, media_type.lower(), options))
+    return [(media_type, options) for _, _, media_type, options in sorted(entries)]
+
+def negotiate_transcript_format(accept: Optional[str]) -> tuple[str, Optional[str]]:
+    """Return (media type, compression) for the most preferred supported Accept entry; JSON otherwise."""
+    for media_type, options in parse_accept(accept):
+        if media_type in JSON_MEDIA_TYPES:
+            break
+        if media_type == ARROW_STREAM_MEDIA_TYPE:
+            compression = options.get("compression", "").lower() or None
+            if compression is not None and compression not in ARROW_COMPRESSIONS:
+                raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                                    detail=f"Unsupported compression '{compression}', use one of {ARROW_COMPRESSIONS}")
+            return ARROW_STREAM_MEDIA_TYPE, compression
+    return "application/json", None
+
+def encode_transcript_arrow(segments: list, compression: Optional[str] = None) -> bytes:
+    """
+    Serialize a transcript column-wise as an Arrow IPC stream.
+    start/end are float32 columns. text and speaker are dictionary-encoded, so every distinct
+    word and speaker label is stored once and rows hold integer codes into those tables.
+    """
+    table = pa.table({
+        "start": pa.array([segment["start"] for segment in segments], type=pa.float32()),
+        "end": pa.array([segment["end"] for segment in segments], type=pa.float32()),
+        "text": pa.array([segment["text"] for segment in segments], type=pa.string()).dictionary_encode(),
+        "speaker": pa.array([segment["speaker"] for segment in segments], type=pa.string()).dictionary_encode(),
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=compression)) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def ndjson(event: dict) -> str:
+    return json.dumps(event) + "\n"
+
+def plan_shards(vad_segments: list, duration: float, target_seconds: float) -> list:
+    """
+    Split [0, duration] into (start, end) shards of roughly `target_seconds`.
+    Each cut is placed in the silence between two VAD chunks, at the gap closest to the target length.
+    """
+    gaps = [(previous["end"] + following["start"]) / 2 for previous, following in zip(vad_segments, vad_segments[1:])]
+    cuts = []
+    target = target_seconds
+    while target < duration - target_seconds / 2:
+        candidates = [gap for gap in gaps if not cuts or gap > cuts[-1]]
+        if not candidates:
+            break
+        cuts.append(min(candidates, key=lambda gap: abs(gap - target)))
+        target = cuts[-1] + target_seconds
+    bounds = [0.0] + cuts + [duration]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def reconcile_speakers(shard_embeddings: list, threshold: float = SPEAKER_MATCH_THRESHOLD) -> list:
+    """
+    Map each shard's local speaker labels to global SPEAKER_XX labels.
+    Shards are visited in order. Their speakers are matched greedily, most similar pair first,
+    against the running mean embedding of each global speaker. Two speakers from one shard
+    never merge, since diarization already told them apart. Unmatched speakers become new
+    global speakers.
+    """
+    centroids = []  # (embedding sum, count) per global speaker
+    mappings = []
+    for embeddings in shard_embeddings:
+        normalized = {}
+        for label, embedding in embeddings.items():
+            vector = np.asarray(embedding, dtype=np.float32)
+            normalized[label] = vector / (np.linalg.norm(vector) + 1e-8)
+
+        candidates = []
+        for label, vector in normalized.items():
+            for index, (total, _) in enumerate(centroids):
+                similarity = float(vector @ total / (np.linalg.norm(total) + 1e-8))
+                candidates.append((similarity, label, index))
+
+        mapping = {}
+        matched = set()
+        for similarity, label, index in sorted(candidates, key=lambda candidate: -candidate[0]):
+            if similarity < threshold:
+                break
+            if label in mapping or index in matched:
+                continue
+            mapping[label] = index
+            matched.add(index)
+
+        for label, vector in normalized.items():
+            if label in mapping:
+                total, count = centroids[mapping[label]]
+                centroids[mapping[label]] = (total + vector, count + 1)
+            else:
+                mapping[label] = len(centroids)
+                centroids.append((vector, 1))
+        mappings.append({label: f"SPEAKER_{index:02d}" for label, index in mapping.items()})
+    return mappings
+
 @app.cls(gpu="A10G", timeout=900, secrets=[modal.Secret.from_name("huggingface"), modal.Secret.from_name("korai-audio")])
 class Transcriber:
     @modal.enter()
     def load_models(self):
         """Load transcription and diarization models into memory."""
-        print("Loading WhisperX model...")
-        self.whisper_model = whisperx.load_model("large-v2", device="cuda", compute_type="float16")
-        print("WhisperX model loaded.")
+        self.whisper_model = None
+        self.shared_asr = connect_shared_asr()
+        if self.shared_asr is not None:
+            # VAD sharding needs the local model, so long audio goes to the service whole
+            print(f"Using the shared ASR service '{ASR_APP_NAME}', skipping local WhisperX model and sharding.")
+        else:
+            print("Loading WhisperX model...")
+            self.whisper_model = whisperx.load_model("large-v2", device="cuda", compute_type="float16")
+            print("WhisperX model loaded.")
 
         hf_token = os.environ.get("HUGGINGFACE_TOKEN")
         if not hf_token:
@@ -58,68 +291,106 @@ class Transcriber:
         self.diarization_pipeline = DiarizationPipeline(use_auth_token=hf_token, device="cuda")
         print("Diarization pipeline loaded.")
 
-    def download_audio(self, youtube_url: str, download_path: pathlib.Path) -> pathlib.Path:
-        """Downloads audio from a YouTube URL and returns the path to the audio file."""
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'cookiefile': '/root/cookies.txt',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'wav',
-                'preferredquality': '192',
-            }],
-            'outtmpl': str(download_path / '%(id)s.%(ext)s'),
-            'quiet': True,
-        }
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print(f"Downloading audio from {youtube_url}...")
-                ydl.download([youtube_url])
-                # Find the downloaded .wav file
-                for file in download_path.glob("*.wav"):
-                    print(f"Audio downloaded to: {file}")
-                    return file
-            raise FileNotFoundError("Failed to download or find the audio file after yt-dlp processing.")
-        except Exception as e:
-            print(f"Error downloading YouTube audio: {e}")
-            raise
+    def run_shard(self, audio: np.ndarray, offset: float, language: Optional[str], diarize: bool) -> dict:
+        """Transcribe (and optionally diarize) one shard; timestamps are shifted by `offset` onto the full timeline."""
+        if self.whisper_model is None:
+            result = transcribe_with_shared_asr(self.shared_asr, audio, language)
+        else:
+            result = self.whisper_model.transcribe(audio, batch_size=16, language=language)
+        speaker_embeddings = {}
+        if diarize:
+            diarize_segments, speaker_embeddings = self.diarization_pipeline(audio, return_embeddings=True)
+            result = whisperx.assign_word_speakers(diarize_segments, result)
+        for segment in result["segments"]:
+            for item in [segment] + segment.get("words", []):
+                for key in ("start", "end"):
+                    if item.get(key) is not None:
+                        item[key] = round(item[key] + offset, 3)
+        return {"segments": result["segments"], "speakers": speaker_embeddings or {}, "language": result.get("language", language)}
+
+    @modal.method()
+    def transcribe_shard(self, pcm16: np.ndarray, offset: float, language: Optional[str], diarize: bool) -> dict:
+        return self.run_shard(pcm16_to_float32(pcm16), offset, language, diarize)
+
+    def transcribe_long_audio(self, audio: np.ndarray, diarize: bool, language: Optional[str] = None) -> dict:
+        """
+        Split audio at VAD silences and transcribe the shards in parallel.
+        This container handles the first shard while the rest run in other Transcriber containers.
+        Speaker labels are reconciled across shards by their diarization embeddings.
+        """
+        start_time = time.time()
+        duration = len(audio) / SAMPLE_RATE
+        shards = plan_shards(speech_chunks(self.whisper_model, audio), duration, SHARD_TARGET_SECONDS)
+        # Detect once so every shard decodes with the same language
+        language = language or self.whisper_model.detect_language(audio)
+        print(f"Transcribing {duration:.0f}s of audio in {len(shards)} shard(s)...")
+
+        pcm16 = to_pcm16(audio)
+        worker = Transcriber()
+        calls = [
+            worker.transcribe_shard.spawn(
+                pcm16[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)], start, language, diarize)
+            for start, end in shards[1:]
+        ]
+        first_start, first_end = shards[0]
+        shard_results = [self.run_shard(
+            audio[int(first_start * SAMPLE_RATE):int(first_end * SAMPLE_RATE)], first_start, language, diarize)]
+        shard_results += [call.get() for call in calls]
+
+        if diarize:
+            mappings = reconcile_speakers([shard["speakers"] for shard in shard_results])
+        else:
+            mappings = [{} for _ in shard_results]
+        segments = []
+        for shard, mapping in zip(shard_results, mappings):
+            for segment in shard["segments"]:
+                for item in [segment] + segment.get("words", []):
+                    if "speaker" in item:
+                        item["speaker"] = mapping.get(item["speaker"], item["speaker"])
+                segments.append(segment)
+
+        print(f"Sharded transcription took {time.time() - start_time:.2f} seconds")
+        return {"segments": segments, "language": language}
 
     @modal.fastapi_endpoint(method="POST")
-    def transcribe(self, request: TranscriptionRequest, token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
+    def transcribe(self, request: TranscriptionRequest, token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+                   accept: Optional[str] = Header(default=None)):
         """
         Accepts a YouTube URL, transcribes the audio with speaker diarization,
         and returns a timestamped transcript.
+        The transcript is JSON by default, or a columnar Arrow stream when the Accept header asks for one.
         """
-        if token.credentials != os.environ["AUTH_TOKEN"]:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token",
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-
-        run_id = str(uuid.uuid4())
-        base_dir = pathlib.Path("/tmp") / run_id
-        base_dir.mkdir(parents=True, exist_ok=True)
+        verify_token(token)
+        media_type, compression = negotiate_transcript_format(accept)
 
         try:
-            # 1. Download Audio
-            audio_path = self.download_audio(request.youtube_url, base_dir)
-            audio = whisperx.load_audio(str(audio_path))
+            # 1. Fetch and decode audio
+            audio = fetch_audio_pcm(request.youtube_url)
 
-            # 2. Transcribe
-            print("Transcribing audio...")
-            transcription_result = self.whisper_model.transcribe(audio, batch_size=16)
-            print("Transcription complete.")
+            sharded = request.sharded
+            if sharded is None:
+                sharded = len(audio) / SAMPLE_RATE >= SHARDED_MIN_SECONDS
+            if sharded and self.whisper_model is not None:
+                # 2-4. Transcribe, diarize and assign speakers per shard, across containers
+                result_with_speakers = self.transcribe_long_audio(audio, diarize=True)
+            else:
+                # 2. Transcribe
+                print("Transcribing audio...")
+                if self.whisper_model is None:
+                    transcription_result = transcribe_with_shared_asr(self.shared_asr, audio)
+                else:
+                    transcription_result = self.whisper_model.transcribe(audio, batch_size=16)
+                print("Transcription complete.")
 
-            # 3. Diarize
-            print("Performing speaker diarization...")
-            diarize_segments = self.diarization_pipeline(audio)
-            print("Diarization complete.")
+                # 3. Diarize
+                print("Performing speaker diarization...")
+                diarize_segments = self.diarization_pipeline(audio)
+                print("Diarization complete.")
 
-            # 4. Assign speakers to transcription
-            print("Assigning speakers to words...")
-            result_with_speakers = whisperx.assign_word_speakers(diarize_segments, transcription_result)
-            print("Speaker assignment complete.")
+                # 4. Assign speakers to transcription
+                print("Assigning speakers to words...")
+                result_with_speakers = whisperx.assign_word_speakers(diarize_segments, transcription_result)
+                print("Speaker assignment complete.")
 
             # 5. Format output
             final_segments = []
@@ -142,13 +413,59 @@ class Transcriber:
                     })
 
 
+            if media_type == ARROW_STREAM_MEDIA_TYPE:
+                return Response(content=encode_transcript_arrow(final_segments, compression), media_type=media_type)
             return {"transcription": final_segments}
 
         except Exception as e:
             print(f"An error occurred: {e}")
             raise HTTPException(status_code=500, detail=str(e))
-        finally:
-            # 6. Cleanup
-            if base_dir.exists():
-                print(f"Cleaning up temporary directory: {base_dir}")
-                shutil.rmtree(base_dir)
+
+    @modal.fastapi_endpoint(method="POST")
+    def transcribe_stream(self, request: TranscriptionRequest, token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
+        """
+        Streaming variant of /transcribe, returned as NDJSON (one JSON event per line):
+        - {"type": "status", "stage": ...} as the job moves through download, transcription and diarization
+        - {"type": "language", "language": ...} once the language is detected
+        - {"type": "segment", "id", "start", "end", "text"} as each VAD chunk is transcribed
+        - {"type": "speakers", "patches": [{"id", "speaker"}, ...]} once diarization completes
+        - {"type": "done"} or {"type": "error", "detail": ...} to finish
+        """
+        verify_token(token)
+        return StreamingResponse(self.stream_events(request.youtube_url), media_type="application/x-ndjson")
+
+    def stream_events(self, youtube_url: str):
+        try:
+            yield ndjson({"type": "status", "stage": "downloading"})
+            audio = fetch_audio_pcm(youtube_url)
+
+            yield ndjson({"type": "status", "stage": "transcribing"})
+            start_time = time.time()
+            segments = []
+            if self.whisper_model is None:
+                # The shared service only returns whole results, so segments arrive in one burst
+                result = transcribe_with_shared_asr(self.shared_asr, audio)
+                transcribed = ((result["language"], segment) for segment in result["segments"])
+            else:
+                transcribed = stream_transcription(self.whisper_model, audio, batch_size=16)
+            for language, segment in transcribed:
+                if not segments:
+                    yield ndjson({"type": "language", "language": language})
+                segment["id"] = len(segments)
+                segments.append(segment)
+                yield ndjson({"type": "segment", **segment})
+            print(f"Streamed {len(segments)} segments in {time.time() - start_time:.2f} seconds")
+
+            yield ndjson({"type": "status", "stage": "diarizing"})
+            diarize_segments = self.diarization_pipeline(audio)
+            result_with_speakers = whisperx.assign_word_speakers(diarize_segments, {"segments": segments})
+            yield ndjson({"type": "speakers", "patches": [
+                {"id": segment["id"], "speaker": segment.get("speaker", "UNKNOWN")}
+                for segment in result_with_speakers["segments"]
+            ]})
+            yield ndjson({"type": "done"})
+
+        except Exception as e:
+            # Headers are already sent, so errors are reported in-stream
+            print(f"An error occurred: {e}")
+            yield ndjson({"type": "error", "detail": str(e)})